@@ -1,7 +1,6 @@
 """
 This module defines functions to fix some text.
 """
-import regex as re
 import wikitextparser as wtp
 
 from datetime import datetime
@@ -69,10 +68,10 @@ class CombinedFix:
         i, n = 1, len(lines)
         while i < n:
             # Find next nonblank line.
-            for j in range(i, n):
-                if not is_blank_line(lines[j]):
-                    break
-            else:
+            j = i
+            while j < n and not lines[j].strip():
+                j += 1
+            if j == n:
                 break
             line = lines[j]
             txt_j, lvl_j = indent_text_lvl(line)
@@ -116,9 +115,10 @@ class CombinedFix:
             if lvl == 0:
                 i -= 1
                 continue
+            # The outer loop resumes at the line where this scan stopped,
+            # so every line is examined a bounded number of times.
             for i in range(i - 1, -1, -1):
-                p = rf"([:*#]+){SPACE_OR_COMMENT_OR_CATEGORY_RE}*\n"
-                m = re.fullmatch(p, lines[i])
+                m = INDENTED_BLANK_LINE_CRE.fullmatch(lines[i])
                 if not m or len(m[1]) >= lvl:
                     break
                 lines[i] = txt + lines[i][len(m[1]) :]
@@ -198,21 +198,19 @@ class CombinedFix:
         # and the wikilink is itself inside an indented line.
         # 2. The numbering for a numbered list might change, even if
         # the change would actually be correct.
-        for i, line in enumerate(lines):
-            if indent_text(line):
+        indents = [indent_text(line) for line in lines]
+        for line, indent in zip(lines, indents):
+            if indent and "[[" in line:
                 wt = wtp.parse(line)
                 for x in wt.wikilinks:
                     s = str(x).lstrip("[").rstrip("]")
                     if s.endswith("\n") or len(line_partition(s)) > 1:
                         return True
         # Prevent possible numbering change.
-        a = indent_text(lines[0])
-        for i in range(1, len(lines)):
-            b = indent_text(lines[i])
+        for a, b in zip(indents, indents[1:]):
             c = self._match_indent(a, b)
             if one_count(a, b) != one_count(a, c):
                 return True
-            a = b
         return False
 
 
@@ -232,52 +230,56 @@ def line_partition(text):
     That way we do not perform an indent style fix incorrectly on subsequent
     lines.
     """
+    if "{" not in text and "[" not in text and "<" not in text:
+        # No markup that could hide a newline, so split on every one.
+        lines = text.split("\n")
+        return [line + "\n" for line in lines[:-1]] + lines[-1:]
+
+    # Newlines inside any of these spans are not split on.
     wt = wtp.parse(text)
-    bad_indices = set()
-    for x in wt.tables + wt.templates + wt.comments:
-        i, j = x.span
-        bad_indices.update(find_all(text, "\n", i, j))
+    bad_spans = [x.span for x in wt.tables + wt.templates + wt.comments]
 
     for x in wt.wikilinks:
         if x.text is None:
             continue
         i, j = x.span
-        bad_indices.update(find_all(text, "\n", text.index("|", i), j))
+        bad_spans.append((text.index("|", i), j))
 
     for x in wt.parser_functions:
         i, j = x.span
-        k = text.find(":", i)
+        # Parser functions without arguments, e.g. {{PAGENAME}}, have no
+        # colon of their own.
+        k = text.find(":", i, j)
         if k != -1:
             i = k
-        bad_indices.update(find_all(text, "\n", i, j))
+        bad_spans.append((i, j))
 
     for x in wt.get_tags():
         i, j = x.span
         if x.name in PARSER_EXTENSION_TAGS:
-            bad_indices.update(find_all(text, "\n", i, j))
+            bad_spans.append((i, j))
         else:
-            close_bracket = text.index(">", i)
-            bad_indices.update(find_all(text, "\n", i, close_bracket))
-
-            open_bracket = text.rindex("<", 0, j)
-            bad_indices.update(find_all(text, "\n", open_bracket, j))
+            bad_spans.append((i, text.index(">", i)))
+            bad_spans.append((text.rindex("<", 0, j), j))
 
     # A line consisting only of spaces and 1+ comments is basically invisible
     # should be treated as part of the preceding line.
-    for m in re.finditer(rf"\n *{COMMENT_RE}{SPACE_OR_COMMENT_RE}*(?=\n)", text):
-        bad_indices.update(find_all(text, "\n", *m.span()))
-
     # Whitespace/comments followed by a Category link do not break lists
     # and are basically invisible.
-    for m in re.finditer(rf"(?:\s|{COMMENT_RE})+{CATEGORY_RE}", text):
-        bad_indices.update(find_all(text, "\n", *m.span()))
+    bad_spans.extend(m.span() for m in INVISIBLE_NEWLINE_CRE.finditer(text))
 
     # Now partition into lines.
-    prev, lines = 0, []
-    for i in find_all(text, "\n"):
-        if i not in bad_indices:
-            lines.append(text[prev : i + 1])
-            prev = i + 1
+    # With the spans sorted, the newlines to split on are exactly those between
+    # the furthest end seen so far and the start of the next span, so each
+    # part of the text is searched at most once however the spans nest.
+    bad_spans.sort()
+    bad_spans.append((len(text), len(text)))
+    prev, pos, lines = 0, 0, []
+    for i, j in bad_spans:
+        for k in find_all(text, "\n", pos, i):
+            lines.append(text[prev : k + 1])
+            prev = k + 1
+        pos = max(pos, i, j)
     # Wikipedia strips newlines from the end, so we must explicitly
     # append the final line.
     # If text does have a newline at the end, this just appends an empty string.
@@ -289,7 +291,7 @@ def line_partition(text):
 # Helper functions
 ################################################################################
 def indent_text(line):
-    return re.match(r"[:*#]*", line)[0]
+    return INDENT_CRE.match(line)[0]
 
 
 def indent_lvl(line):
@@ -302,7 +304,7 @@ def indent_text_lvl(line):
 
 
 def is_blank_line(line):
-    return bool(re.fullmatch(r"\s*", line))
+    return not line.strip()
 
 
 def find_all(s, sub, start=0, end=None):
@@ -343,10 +345,14 @@ def has_list_breaking_newline(line):
     actually do break lists so that we don't edit stuff that shouldn't be
     edited, e.g. <pre></pre>. This function lets us detect such line breaks.
     """
+    # Most lines contain no list-breaking tag at all,
+    # in which case there is no need to parse them.
+    if not LIST_BREAKING_TAG_CRE.search(line):
+        return False
     wt = wtp.parse(line)
     for x in wt.get_tags():
         # if breaking tag with '\n' in contents...
-        if x.name not in PARSER_EXTENSION_TAGS - NON_BREAKING_TAGS:
+        if x.name not in LIST_BREAKING_TAGS:
             continue
         if "\n" in x.contents:
             return True
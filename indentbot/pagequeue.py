@@ -3,18 +3,20 @@ This module is for tracking recent changes and generating Page objects
 to be edited.
 It uses a priority queue based on the most recent edit-time of a page.
 """
-import heapq
+import functools
 import itertools
 import logging
+import re
 import time
 
-from datetime import datetime, timedelta
+from calendar import timegm
+from collections import OrderedDict
+from datetime import timedelta
 
-import regex as re
 import wikitextparser as wtp
 
 from pywikibot import Page, Site, User
-from pywikibot.exceptions import *
+from pywikibot.exceptions import NoPageError
 from pywikibot.pagegenerators import PreloadingGenerator
 
 import patterns as pat
@@ -26,71 +28,100 @@ SITE.login(user="IndentBot")
 
 # Certain users are allowed to stop and resume the bot.
 ON_PAUSE = False
+
+# Map usernames to (fetch time, groups) to avoid repeated API lookups.
+# Ordered by fetch time, oldest first.
+GROUPS_CACHE = OrderedDict()
+GROUPS_CACHE_TTL = 300  # seconds
+GROUPS_CACHE_SIZE = 4096
+
+# Seconds after which preloaded page text is considered stale.
+PRELOAD_MAX_AGE = 60
+
+# Length of the tail of a page searched for signatures before the rest.
+SIGNATURE_TAIL_LEN = 262144
+SANDBOX_RE = re.compile(r"/sandbox(?: ?\d+)?(?:/|\Z)", flags=re.I)
+# Every name accepted by has_bot_allow_template contains "bots".
+BOTS_TEMPLATE_PROBE_RE = re.compile(r"\{\{[^{}|]*bots", flags=re.I)
 ################################################################################
 
 
 class PageQueue:
     def __init__(self):
-        self._pq = []
-        self._len = 0
-        self._entry_finder = {}
-        self._REMOVED = "<removed-task>"
+        # Map titles to (priority, counter, page). The queue only ever
+        # holds a few hundred pages and is drained once per chunk, so a
+        # dict plus one sort per pop_up_to is cheaper than keeping a heap.
+        # The counter keeps pages with equal priorities in insertion order.
+        self._pages = {}
         self._counter = itertools.count(start=1)
 
     def clear(self):
-        self._pq.clear()
-        self._len = 0
-        self._entry_finder.clear()
+        self._pages.clear()
         self._counter = itertools.count(start=1)
 
     def __len__(self):
-        return self._len
+        return len(self._pages)
 
     def remove_page(self, title):
-        entry = self._entry_finder.pop(title)
-        entry[-1] = self._REMOVED
-        self._len -= 1
-
-    def add_page(self, page):
-        """Adds a page OR updates the priority of a page."""
-        title = page.title(with_ns=True)
-        if title in self._entry_finder:
-            self.remove_page(title)
-        entry = [page.editTime(), next(self._counter), page]
-        self._entry_finder[title] = entry
-        heapq.heappush(self._pq, entry)
-        self._len += 1
+        del self._pages[title]
+
+    def add_page(self, page, priority=None):
+        """
+        Adds a page OR updates the priority of a page.
+        The priority defaults to the page's edit time.
+        """
+        if priority is None:
+            priority = to_epoch(page.editTime())
+        self._pages[page.title(with_ns=True)] = (
+            priority,
+            next(self._counter),
+            page,
+        )
 
     def add_from(self, it):
         for page in it:
             self.add_page(page)
 
     def pop_page(self):
-        while self._pq:
-            prio, count, page = heapq.heappop(self._pq)
-            if page is not self._REMOVED:
-                del self._entry_finder[page.title(with_ns=True)]
-                self._len -= 1
-                return page
-        raise KeyError("pop from an empty PageQueue")
+        if not self._pages:
+            raise KeyError("pop from an empty PageQueue")
+        title = min(self._pages, key=self._pages.__getitem__)
+        return self._pages.pop(title)[2]
 
     def pop_up_to(self, priority):
-        while self._pq:
-            prio, page = self._pq[0][0], self._pq[0][2]
+        """
+        Yield pages with priority at most the given priority, after
+        reloading them. Pages which were edited again in the meantime are
+        put back in the queue.
+
+        The pages are reloaded in batches with a PreloadingGenerator
+        rather than with one request per page. Since saves are throttled,
+        pages yielded more than PRELOAD_MAX_AGE seconds after the first one
+        are reloaded again individually, so that an edit made in the
+        meantime requeues the page instead of causing an edit conflict.
+        """
+        priority = to_epoch(priority)
+        ready = sorted(
+            (entry, title)
+            for title, entry in self._pages.items()
+            if entry[0] <= priority
+        )
+        for _, title in ready:
+            del self._pages[title]
+        start = time.monotonic()
+        for page in PreloadingGenerator(entry[2] for entry, _ in ready):
+            if time.monotonic() - start > PRELOAD_MAX_AGE:
+                try:
+                    page.get(force=True, get_redirect=True)
+                except NoPageError:
+                    continue
+            if not page.exists() or page.isRedirectPage():
+                continue
+            prio = to_epoch(page.editTime())
             if prio > priority:
-                break
-            if page is self._REMOVED:
-                heapq.heappop(self._pq)
+                self.add_page(page, prio)
             else:
-                try:
-                    page.text = page.get(force=True)
-                except (IsRedirectPageError, NoPageError):
-                    self.pop_page()
-                else:
-                    if page.editTime() > priority:
-                        self.add_page(page)
-                    else:
-                        yield self.pop_page()
+                yield page
 
 
 def recent_changes_gen(start, end):
@@ -99,31 +130,19 @@ def recent_changes_gen(start, end):
     with the potential to be edited by IndentBot.
     """
     logger.info(f"Retrieving edits from {start} to {end}.")
-    # 0   (Main/Article)  Talk            1
-    # 2   User            User talk       3
-    # 4   Wikipedia       Wikipedia talk  5
-    # 6   File            File talk       7
-    # 8   MediaWiki       MediaWiki talk  9
-    # 10  Template        Template talk   11
-    # 12  Help            Help talk       13
-    # 14  Category        Category talk   15
-    # 100 Portal          Portal talk     101
-    # 118 Draft           Draft talk      119
-    # 710 TimedText       TimedText talk  711
-    # 828 Module           Module talk    829
-    TALK_SPACES = (1, 3, 5, 7, 11, 13, 15, 101, 119, 711, 829)
-    OTHER_SPACES = (4, 10)
-    NAMESPACES = TALK_SPACES + OTHER_SPACES
-    for change in SITE.recentchanges(
+    rcgen = SITE.recentchanges(
         start=start,
         end=end,
         reverse=True,
         changetype="edit",
-        namespaces=NAMESPACES,
+        namespaces=pat.NAMESPACES,
         minor=False,
         bot=False,
         redirect=False,
-    ):
+    )
+    # Only request the properties used here and in potential_page_gen.
+    rcgen.request["rcprop"] = "title|timestamp|sizes"
+    for change in rcgen:
         if change["newlen"] - change["oldlen"] < 100:
             continue
         if should_not_edit(change["title"]):
@@ -144,7 +163,7 @@ def potential_page_gen(changes):
     for page in PreloadingGenerator(Page(SITE, title) for title in pdict):
         title, text = page.title(with_ns=True), page.text
         # User/User talk pages must explicitly allow IndentBot
-        if title.startswith("User") and not has_bot_allow_template(text):
+        if page.namespace() in (2, 3) and not has_bot_allow_template(text):
             continue
         # In the Template namespace, only DYK nominations are allowed
         if title.startswith("Template:") and not valid_template_page(title):
@@ -198,24 +217,22 @@ def continuous_page_gen(chunk, delay):
 ################################################################################
 # Helper functions
 ################################################################################
+def to_epoch(ts):
+    """
+    Convert a naive UTC datetime, e.g. a pywikibot Timestamp, to an integer
+    POSIX timestamp. PageQueue uses these as priorities so that
+    comparisons are plain int comparisons.
+    """
+    return timegm(ts.timetuple())
+
+
 def is_sandbox(title):
     """
     Return True if the title looks like it belongs to a sandbox.
     """
-    SANDBOXES = (
-        "Wikipedia:Sandbox",
-        "Wikipedia talk:Sandbox",
-        "Wikipedia:Articles for creation/AFC sandbox",
-        "Wikipedia:AutoWikiBrowser/Sandbox",
-        "User:Sandbox",
-        "User talk:Sandbox",
-        "User talk:Sandbox for user warnings",
-        "User talk:192.0.2.16",
-        "User talk:2001:DB8:10:0:0:0:0:1",
-    )
-    if title in SANDBOXES:
+    if title in pat.SANDBOXES:
         return True
-    return bool(re.search(r"/sandbox(?: ?\d+)?(?:/|\Z)", title, flags=re.I))
+    return bool(SANDBOX_RE.search(title))
 
 
 def valid_template_page(title):
@@ -223,37 +240,41 @@ def valid_template_page(title):
     Only edit certain template pages.
     An "opt-in" for the template namespace.
     """
-    return title.startswith("Template:Did you know nominations/")
+    return title.startswith(pat.TEMPLATE_PREFIXES)
 
 
+@functools.lru_cache(maxsize=8192)
 def should_not_edit(title):
     """
     Returns True iff a page should NOT be edited based only on its title.
+    Memoized since busy pages show up in recent changes again and again.
     """
     if is_sandbox(title):
         return True
     if title.startswith("Template:") and not valid_template_page(title):
         return True
-    BAD_TITLE_PREFIXES = frozenset(
-        [
-            "Wikipedia:Arbitration/Requests/",
-        ]
-    )
-    if any(title.startswith(x) for x in BAD_TITLE_PREFIXES):
-        return True
-    return False
+    return title.startswith(pat.BAD_TITLE_PREFIXES)
 
 
 def has_n_sigs(n, text):
     """
     Returns True iff we find at least n user signatures in the text.
     """
-    count = 0
-    for m in re.finditer(pat.SIGNATURE_PATTERN, text):
-        count += 1
-        if count >= n:
-            return True
-    return False
+    # Every signature ends with "(UTC)", and counting a literal is cheap.
+    if text.count("(UTC)") < n:
+        return False
+
+    def nth_match_from(pos):
+        # islice skips the first n - 1 matches without a Python-level loop.
+        matches = pat.SIGNATURE_RE.finditer(text, pos)
+        return next(itertools.islice(matches, n - 1, None), None) is not None
+
+    # Signatures cluster near the end of discussion pages, so a long page
+    # usually succeeds without scanning all of it.
+    tail = len(text) - SIGNATURE_TAIL_LEN
+    if tail > 0 and nth_match_from(tail):
+        return True
+    return nth_match_from(0)
 
 
 def has_sig_with_timestamp(ts, text):
@@ -266,14 +287,34 @@ def has_sig_with_timestamp(ts, text):
     Example signature:
     [[User:ASDF|FDSA]] ([[User talk:ASDF|talk]]) 01:24, 22 March 2022 (UTC)
     """
-    dt = datetime.fromisoformat(ts.rstrip("Z"))
-    mm = dt.strftime("%M")
-    hh = dt.strftime("%H")
-    day = dt.day
-    mon = dt.strftime("%B")
-    year = dt.strftime("%Y")
-    p = rf"\[\[[Uu]ser(?: talk)?:[^\n]+?{hh}:{mm}, {day} {mon} {year} \(UTC\)"
-    return re.search(p, text)
+    # Timestamps are always in the form YYYY-MM-DDTHH:MM:SSZ.
+    year, mon, day = ts[:4], pat.MONTH_NAMES[int(ts[5:7])], ts[8:10].lstrip("0")
+    hh, mm = ts[11:13], ts[14:16]
+    # Most texts do not contain the timestamp at all, and a plain substring
+    # search rejects those much faster than the regex below.
+    stamp = f"{hh}:{mm}, {day} {mon} {year} (UTC)"
+    last = text.rfind(stamp)
+    if last == -1:
+        return None
+    # A match must start on the same line as some occurrence of the stamp.
+    # The signature for a fresh edit is usually the last occurrence, so try
+    # its line first and fall back to the line of the first occurrence.
+    p = sig_with_stamp_re(stamp)
+    if m := p.search(text, text.rfind("\n", 0, last) + 1):
+        return m
+    first = text.find(stamp)
+    if first == last:
+        return None
+    return p.search(text, text.rfind("\n", 0, first) + 1)
+
+
+@functools.lru_cache(maxsize=4096)
+def sig_with_stamp_re(stamp):
+    """
+    Return a compiled regex matching a user signature ending with stamp.
+    Cached since the same timestamp is usually checked against many pages.
+    """
+    return re.compile(rf"\[\[[Uu]ser(?: talk)?:[^\n]+?{re.escape(stamp)}")
 
 
 def has_bot_allow_template(text):
@@ -281,6 +322,9 @@ def has_bot_allow_template(text):
     Returns True iff {{Bots}} (or one of its redirects) exists
     and IndentBot is named in the allow list.
     """
+    # Skip the full parse when no such template can be present.
+    if not BOTS_TEMPLATE_PROBE_RE.search(text):
+        return False
     wt = wtp.parse(text)
     for template in wt.templates:
         try:
@@ -290,13 +334,60 @@ def has_bot_allow_template(text):
             continue
         if n not in ("Bots", "Nobots", "NOBOTS", "Botsdeny", "Bots deny"):
             continue
-        if allowed := template.get_arg("allow"):
-            for x in allowed.value.split(","):
-                if x.strip().lower() == "indentbot":
-                    return True
+        allowed = template.get_arg("allow")
+        if allowed and any(
+            x.strip().lower() == "indentbot" for x in allowed.value.split(",")
+        ):
+            return True
     return False
 
 
+def _cached_groups(user, now):
+    cached = GROUPS_CACHE.get(user)
+    if cached and now - cached[0] < GROUPS_CACHE_TTL:
+        return cached[1]
+    return None
+
+
+def _cache_groups(user, groups, now):
+    """
+    Add an entry to GROUPS_CACHE, first dropping expired entries and then
+    the oldest ones if the cache is full.
+    """
+    GROUPS_CACHE.pop(user, None)
+    while GROUPS_CACHE and (
+        len(GROUPS_CACHE) >= GROUPS_CACHE_SIZE
+        or now - next(iter(GROUPS_CACHE.values()))[0] >= GROUPS_CACHE_TTL
+    ):
+        GROUPS_CACHE.popitem(last=False)
+    GROUPS_CACHE[user] = (now, groups)
+
+
+def user_groups(user):
+    """
+    Return a frozenset of the groups of the given user.
+    Results are cached for GROUPS_CACHE_TTL seconds.
+    """
+    now = time.monotonic()
+    groups = _cached_groups(user, now)
+    if groups is None:
+        groups = frozenset(User(SITE, user).groups())
+        _cache_groups(user, groups, now)
+    return groups
+
+
+def prefetch_user_groups(users):
+    """
+    Fill GROUPS_CACHE for the given users with a single API query,
+    skipping users whose groups are already cached.
+    """
+    now = time.monotonic()
+    missing = [u for u in users if _cached_groups(u, now) is None]
+    if missing:
+        for data in SITE.users(missing):
+            _cache_groups(data["name"], frozenset(data.get("groups", ())), now)
+
+
 def check_pause_or_resume(start, end):
     """
     Stop or resume the bot based on a talk page edits.
@@ -306,18 +397,22 @@ def check_pause_or_resume(start, end):
     global ON_PAUSE
     original_status = ON_PAUSE
     page = Page(SITE, "User talk:IndentBot")
-    for rev in page.revisions(starttime=start, endtime=end, reverse=True):
+    revs = list(page.revisions(starttime=start, endtime=end, reverse=True))
+    maintainers = pat.MAINTAINERS
+    prefetch_user_groups({rev["user"] for rev in revs} - maintainers)
+    for rev in revs:
         user = rev["user"]
-        groups = User(SITE, user).groups()
+        if user in maintainers:
+            can_stop, can_resume = True, True
+        else:
+            groups = user_groups(user)
+            can_stop = not groups.isdisjoint(pat.STOP_GROUPS)
+            can_resume = not groups.isdisjoint(pat.RESUME_GROUPS)
+            if not can_stop:
+                continue
         cmt = rev.get("comment", "")
         revid = rev.revid
         ts = rev.timestamp.isoformat()
-        if user in pat.MAINTAINERS or "sysop" in groups:
-            can_stop, can_resume = True, True
-        elif "autoconfirmed" in groups:
-            can_stop, can_resume = True, False
-        else:
-            continue
         msg = (
             "{} by {}.\n"
             "    Revid     = {}\n"
@@ -1,20 +1,42 @@
 """
 This module defines some utilities and constants.
 """
-from calendar import month_name
+import functools
+import re as stdlib_re
 
 import pywikibot as pwb
 import regex as re
 
 ################################################################################
+@functools.lru_cache(maxsize=256)
+def _compile(pattern, flags=0):
+    return re.compile(pattern, flags)
+
+
+# Strings without regex metacharacters, which match only themselves.
+_LITERAL_RE = stdlib_re.compile(r"[^.^$*+?()[\]{}|\\]*")
+
+
 def pattern_count(pattern, text, flags=0):
-    return sum(1 for x in re.finditer(pattern, text, flags))
+    # Literal patterns are counted with str.count, without the regex engine.
+    if isinstance(pattern, str) and not flags and _LITERAL_RE.fullmatch(pattern):
+        return text.count(pattern)
+    if not hasattr(pattern, "search"):
+        pattern = _compile(pattern, flags)
+    # findall returns one item per match, even when the pattern has groups,
+    # without building a Match object for each one.
+    return len(pattern.findall(text))
 
 
 def find_pattern(pattern, text, start=0, end=None, flags=0):
+    """
+    pattern may be a string or an already compiled pattern, in which case
+    flags is ignored.
+    """
     if end is None:
         end = len(text)
-    pattern = re.compile(pattern, flags)
+    if not hasattr(pattern, "search"):
+        pattern = _compile(pattern, flags)
     m = pattern.search(text, start, end)
     if m:
         return m.start()
@@ -22,9 +44,15 @@ def find_pattern(pattern, text, start=0, end=None, flags=0):
 
 
 def rfind_pattern(pattern, text, start=0, end=None, flags=0):
+    """
+    Like find_pattern, but searches backwards.
+    A compiled pattern is recompiled (once) with the REVERSE flag.
+    """
     if end == None:
         end = len(text)
-    pattern = re.compile(pattern, flags=flags | re.REVERSE)
+    if hasattr(pattern, "search"):
+        pattern, flags = pattern.pattern, pattern.flags | flags
+    pattern = _compile(pattern, flags | re.REVERSE)
     m = pattern.search(text, start, end)
     if m:
         return m.start()
@@ -64,10 +92,18 @@ STATUSES = ("inactive", "paused", "active")
 INACTIVE, PAUSED, ACTIVE = STATUSES
 
 
+@functools.lru_cache(maxsize=None)
+def _status_page():
+    """
+    The status Page object is built once and reused.
+    """
+    return pwb.Page(pwb.Site("en", "wikipedia"), "User:IndentBot/status")
+
+
 def set_status_page(status):
     if status not in STATUSES:
         raise ValueError(f"status must be in {STATUSES}.")
-    page = pwb.Page(pwb.Site("en", "wikipedia"), "User:IndentBot/status")
+    page = _status_page()
     if page.text != status:
         page.text = status
         page.save(
@@ -79,22 +115,110 @@ def set_status_page(status):
 
 
 def get_status_page():
-    page = pwb.Page(pwb.Site("en", "wikipedia"), "User:IndentBot/status")
-    return page.text
+    # Always reload, since the status may have been changed on-wiki.
+    # Like page.text, a missing page reads as "" and a redirect as its text.
+    try:
+        return _status_page().get(force=True, get_redirect=True)
+    except pwb.exceptions.NoPageError:
+        return ""
 
 
 ################################################################################
 # Regular expressions
 ################################################################################
-COMMENT_RE = r"(?:<!--(?:.(?<!-->))*?-->)"
+# A comment ends at the first "-->" after the opening "<!--". Matching the
+# body as "anything but a '-' which starts '-->'" avoids a lookbehind per
+# character. Comments spanning lines are deliberately not matched.
+COMMENT_RE = r"(?:<!--(?:[^\n-]|-(?!->))*-->)"
 SPACE_OR_COMMENT_RE = rf"(?: |{COMMENT_RE})"
 CATEGORY_RE = rf"(?:\[\[{SPACE_OR_COMMENT_RE}*(?i:Category):(?:[^\n](?<!\]\]))+?\]\])"
 SPACE_OR_COMMENT_OR_CATEGORY_RE = rf"(?:{SPACE_OR_COMMENT_RE}|{CATEGORY_RE})"
 
+# Compiled patterns (suffix _CRE) for the ones applied to whole pages.
+# Newlines inside a match of this pattern are "invisible": either the match
+# is a line consisting only of spaces and 1+ comments, or it is
+# whitespace/comments followed by a Category link.
+# Both alternatives share one pass over the text. Where matches of the two
+# would overlap, the one found still covers the same newlines.
+INVISIBLE_NEWLINE_CRE = re.compile(
+    rf"(?P<comment_line>\n *{COMMENT_RE}{SPACE_OR_COMMENT_RE}*(?=\n))"
+    rf"|(?P<category>(?:\s|{COMMENT_RE})+{CATEGORY_RE})"
+)
+# The list markup at the start of a line.
+INDENT_CRE = re.compile(r"[:*#]*")
+# Cheap test for whether a page has any list markup at all.
+INDENTED_LINE_CRE = re.compile(r"^[:*#]", re.M)
+# A line with list markup but no visible content.
+INDENTED_BLANK_LINE_CRE = re.compile(rf"([:*#]+){SPACE_OR_COMMENT_OR_CATEGORY_RE}*\n")
+
 ################################################################################
 # Constants
 ################################################################################
 MAINTAINERS = frozenset(("IndentBot", "Notacardoor"))
+# User groups allowed to pause and resume the bot, besides maintainers.
+STOP_GROUPS = frozenset(("autoconfirmed", "sysop"))
+RESUME_GROUPS = frozenset(("sysop",))
+
+EDIT_SUMMARY = "Adjusted indent/list markup per [[MOS:INDENTMIX]]. ({} lines affected)"
+
+# Namespaces in which IndentBot looks for recent changes.
+# 0   (Main/Article)  Talk            1
+# 2   User            User talk       3
+# 4   Wikipedia       Wikipedia talk  5
+# 6   File            File talk       7
+# 8   MediaWiki       MediaWiki talk  9
+# 10  Template        Template talk   11
+# 12  Help            Help talk       13
+# 14  Category        Category talk   15
+# 100 Portal          Portal talk     101
+# 118 Draft           Draft talk      119
+# 710 TimedText       TimedText talk  711
+# 828 Module           Module talk    829
+TALK_SPACES = (1, 3, 5, 7, 11, 13, 15, 101, 119, 711, 829)
+OTHER_SPACES = (4, 10)
+NAMESPACES = TALK_SPACES + OTHER_SPACES
+
+# Title filters shared by the recent changes and page generators.
+SANDBOXES = frozenset(
+    (
+        "Wikipedia:Sandbox",
+        "Wikipedia talk:Sandbox",
+        "Wikipedia:Articles for creation/AFC sandbox",
+        "Wikipedia:AutoWikiBrowser/Sandbox",
+        "User:Sandbox",
+        "User talk:Sandbox",
+        "User talk:Sandbox for user warnings",
+        "User talk:192.0.2.16",
+        "User talk:2001:DB8:10:0:0:0:0:1",
+    )
+)
+# Tuples so that str.startswith can check all prefixes in one call.
+TEMPLATE_PREFIXES = ("Template:Did you know nominations/",)
+BAD_TITLE_PREFIXES = ("Wikipedia:Arbitration/Requests/",)
+
+# Signature timestamps always use English month names, whatever the locale.
+# Index 0 is empty so that MONTH_NAMES[1] == "January", as in calendar.
+MONTH_NAMES = (
+    "",
+    "January",
+    "February",
+    "March",
+    "April",
+    "May",
+    "June",
+    "July",
+    "August",
+    "September",
+    "October",
+    "November",
+    "December",
+)
+# The same names, factored by common prefix so that the regex engine
+# does not try twelve alternatives at every candidate position.
+MONTH_NAME_RE = (
+    r"(?:J(?:anuary|u(?:ne|ly))|February|Ma(?:rch|y)|A(?:pril|ugust)"
+    r"|September|October|November|December)"
+)
 
 # Example signature:
 # [[User:ASDF|FDSA]] ([[User talk:ASDF|talk]]) 01:24, 22 March 2022 (UTC)
@@ -103,10 +227,13 @@ SIGNATURE_PATTERN = (
     + r"([0-2]\d):([0-5]\d), "  # user page link
     + r"([1-3]?\d) "  # hh:mm
     + "("  # day
-    + "|".join(month_name[1:])
+    + MONTH_NAME_RE
     + ") "
     + r"(2\d{3}) \(UTC\)"  # month name  # yyyy (UTC)
 )
+# Patterns which need none of the regex module's extensions are compiled
+# with the standard library's engine, which is faster for simple patterns.
+SIGNATURE_RE = stdlib_re.compile(SIGNATURE_PATTERN)
 
 PARSER_EXTENSION_TAGS = frozenset(
     (
@@ -182,6 +309,15 @@ NON_BREAKING_TAGS = frozenset(
         "templatedata",
     )
 )
+LIST_BREAKING_TAGS = PARSER_EXTENSION_TAGS - NON_BREAKING_TAGS
+# Opening tag of any list-breaking tag. Longest names come first so that
+# the alternation never stops at a shorter name which is a prefix.
+LIST_BREAKING_TAG_CRE = re.compile(
+    r"<(?:"
+    + "|".join(sorted(map(re.escape, LIST_BREAKING_TAGS), key=len, reverse=True))
+    + r")\b",
+    flags=re.I,
+)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,21 @@
 import argparse
+import atexit
 import logging
+import queue
 import sys
 import time
 
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
-from pywikibot import Page
-from pywikibot.exceptions import *
+from pywikibot.exceptions import (
+    AbuseFilterDisallowedError,
+    EditConflictError,
+    LockedPageError,
+    OtherPageSaveError,
+    PageSaveRelatedError,
+    SpamblacklistError,
+)
 
 import patterns as pat
 
@@ -39,7 +48,7 @@ def get_args():
         "-t",
         "--total",
         type=int,
-        default=float("inf"),
+        default=None,
         help="maximum number of edits to make (default: unlimited)",
     )
 
@@ -91,6 +100,9 @@ def set_up_logging(logfile):
     Set up log file at the given location, otherwise logs are stored in
     $HOME/logs/indentbot.log.
     The directory $HOME/logs will be created if it does not exist.
+    Records are handed off through a queue and written to the file by a
+    background listener thread, so logging never blocks the main loop.
+    The log file is rotated at 10 MB, keeping 5 old files.
     """
     logging.getLogger("pywiki").setLevel(logging.WARNING)
     logger = logging.getLogger("indentbot_logger")
@@ -99,53 +111,71 @@ def set_up_logging(logfile):
         path.mkdir(exist_ok=True)
         path = path / "indentbot.log"
         logfile = str(path)
-    file_handler = logging.FileHandler(filename=logfile, mode="a")
+    file_handler = RotatingFileHandler(
+        filename=logfile, mode="a", maxBytes=10_000_000, backupCount=5
+    )
     formatter = logging.Formatter("%(asctime)s %(levelname)s: %(message)s")
     file_handler.setFormatter(formatter)
     file_handler.setLevel(logging.INFO)
-    logger.addHandler(file_handler)
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(QueueHandler(log_queue))
     logger.setLevel(logging.INFO)
 
 
+# Save errors which are logged and skipped rather than ending the run.
+SAVE_WARNINGS = {
+    EditConflictError: "Edit conflict for %s.",
+    LockedPageError: "%s is locked.",
+    AbuseFilterDisallowedError: "Edit to %s prevented by abuse filter.",
+    SpamblacklistError: "Edit to %s prevented by spam blacklist.",
+}
+
+
+def save_error_warning(err):
+    """
+    Returns the warning to log for a save error which should not end the run,
+    or None if the error should be re-raised.
+    """
+    for cls in type(err).__mro__:
+        if cls in SAVE_WARNINGS:
+            return SAVE_WARNINGS[cls]
+    if isinstance(err, OtherPageSaveError) and "restricted by {{bots}}" in str(err):
+        return "Edit to %s prevented by {{bots}}."
+
+
 def fix_page(page, fixer, *, threshold):
     """
-    Apply fixes to page's text and save it if
-    fixer.total_score >= threshold.
+    Apply fixes to page's text and save it if the
+    total score returned by fixer.fix is >= threshold.
     If save is successful, returns a string for Template:Diff2.
     Returns None (or raises an exception) otherwise.
     """
-    title, title_link = page.title(with_ns=True), page.title(as_link=True)
+    title = page.title(with_ns=True)
+    # Every fix works on indented lines, so pages without any have nothing
+    # to fix.
+    if not pat.INDENTED_LINE_CRE.search(page.text):
+        return
     # Only edit User/User talk pages if IndentBot is explicitly allowed
-    if title.startswith("User") and not has_bot_allow_template(page.text):
+    if page.namespace() in (2, 3) and not has_bot_allow_template(page.text):
         return
-    page.text = fixer.fix(page.text)[0]
-    if fixer.total_score < threshold:
+    page.text, score = fixer.fix(page.text)
+    total_score = sum(score)
+    if total_score < threshold:
         return
-    summary = (
-        "Adjusted indent/list markup per [[MOS:INDENTMIX]]. "
-        f"({fixer.total_score} lines affected)"
-    )
+    summary = pat.EDIT_SUMMARY.format(total_score)
     try:
         page.save(summary=summary, minor=True, botflag=True, nocreate=True, quiet=True)
-    except EditConflictError:
-        logger.warning(f"Edit conflict for {title_link}.")
-    except LockedPageError:
-        logger.warning(f"{title_link} is locked.")
-    except AbuseFilterDisallowedError:
-        logger.warning(f"Edit to {title_link} prevented by abuse filter.")
-    except SpamblacklistError:
-        logging.warning(f"Edit to {title_link} prevented by spam blacklist.")
-    except OtherPageSaveError as err:
-        if err.args.startswith("Editing restricted by {{bots}}"):
-            logger.warning(f"Edit to {title_link} prevented by {{{{bots}}}}.")
-        else:
-            logger.exception(f"OtherPageSaveError for {title_link}.")
+    except PageSaveRelatedError as err:
+        warning = save_error_warning(err)
+        if warning is None:
+            logger.exception("%s for [[%s]].", type(err).__name__, title)
             raise
-    except PageSaveRelatedError:
-        logger.exception(f"PageSaveRelatedError for {title_link}.")
-        raise
+        logger.warning(warning, f"[[{title}]]")
     except Exception:
-        logger.exception(f"Error when saving {title_link}.")
+        logger.exception("Error when saving [[%s]].", title)
         raise
     else:
         return pat.diff_template(page)
@@ -165,10 +195,11 @@ def mainloop(args):
     threshold = args.threshold
     verbose = args.verbose
     logger.info(
-        (
-            "Starting run. "
-            f"(chunk={chunk}, delay={delay}, limit={limit}, threshold={threshold})"
-        )
+        "Starting run. (chunk=%s, delay=%s, limit=%s, threshold=%s)",
+        chunk,
+        delay,
+        limit,
+        threshold,
     )
     t1 = time.perf_counter()
     count = 0
@@ -186,24 +217,24 @@ def mainloop(args):
             count += 1
             if verbose:
                 print(diff)
-        if count >= limit:
-            logger.info(f"Limit ({limit}) reached.")
-            break
+            if limit is not None and count >= limit:
+                logger.info("Limit (%s) reached.", limit)
+                break
     t2 = time.perf_counter()
-    logger.info(f"Ending run. Made {count} edits in {round(t2-t1, 2)} seconds.")
+    logger.info("Ending run. Made %s edits in %.2f seconds.", count, t2 - t1)
 
 
 def run():
     args = get_args()
     set_up_logging(logfile=args.logfile)
     if pat.get_status_page() != pat.INACTIVE:
-        logger.error(f"Cannot start run due to invalid status page.")
+        logger.error("Cannot start run due to invalid status page.")
         return 1
     pat.set_status_page(pat.ACTIVE)
     try:
         mainloop(args)
     except BaseException as e:
-        logger.error(f"Ending run due to {type(e).__name__}.")
+        logger.error("Ending run due to %s.", type(e).__name__)
         raise
     finally:
         pat.set_status_page(pat.INACTIVE)
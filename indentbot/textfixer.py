@@ -11,13 +11,15 @@ class TextFixer:
         nonnegative numeric score.
         It is up to the callable what the score represents, but ideally it
         reoresents the "amount" of fixing that's been done by the callable.
+        Applying a fix again to text it returned with score 0 must give
+        score 0 again, since the loop below skips such calls.
 
         The parameter onepass determines if only one round of fixes
         will be applied, or if the fixes will be applied in a loop until
-        the text no longer changes.
+        a round in which every fix has score 0.
         By default, if there is only one fix given, it will be applied
-        once. Otherwise fixes are applied in a loop until the text no
-        longer changes.
+        once. Otherwise fixes are applied in a loop until no fix has
+        anything left to do.
         """
         if not fixes:
             raise ValueError("No fixes provided")
@@ -45,13 +47,20 @@ class TextFixer:
                 text, s = f(text)
                 score[i] += s
         else:
+            # The text each fix last returned with score 0. A fix is skipped
+            # while the text is still that, since it would score 0 again.
+            clean = [None] * len(self.fixes)
             while True:
                 changed = False
                 for i, f in enumerate(self.fixes):
+                    if text == clean[i]:
+                        continue
                     text, s = f(text)
                     if s:
                         score[i] += s
                         changed = True
+                    else:
+                        clean[i] = text
                 if not changed:
                     break
         score = tuple(score)